@@ -1,7 +1,6 @@
 # Standard output/error tee utilities
 
 # Imports
-import io
 import sys
 import weakref
 import traceback
@@ -66,9 +65,11 @@ class StdTee:
 	# chronological order, you can try auto_flush=True. Note that it is impossible for the content tee-ed to file to
 	# end up out of order, so this applies to the original stdout/stderr targets only. If performance is an issue, you
 	# can disable line buffering of the file (enabled by default), but then you have to be aware that sending SIGKILL
-	# (e.g. Stop button in PyCharm) to the process can leave output lines missing from the file.
+	# (e.g. Stop button in PyCharm) to the process can leave output lines missing from the file. The file is then written
+	# in blocks of file_buffer_size bytes, but is still flushed whenever stdout/stderr is flushed (e.g. print(flush=True)),
+	# unless file_flush is False. Disabling both file_line_buffered and file_flush minimizes the number of write syscalls.
 
-	def __init__(self, file_path, append=False, tee_stdout=True, tee_stderr=True, tee_exc_tb=True, auto_flush=False, file_line_buffered=True):
+	def __init__(self, file_path, append=False, tee_stdout=True, tee_stderr=True, tee_exc_tb=True, auto_flush=False, file_line_buffered=True, file_buffer_size=65536, file_flush=True):
 
 		self.file_path = file_path
 		self.append = append
@@ -77,6 +78,8 @@ class StdTee:
 		self.tee_exc_tb = tee_exc_tb
 		self.auto_flush = auto_flush
 		self.file_line_buffered = file_line_buffered
+		self.file_buffer_size = file_buffer_size
+		self.file_flush = file_flush
 
 		self._file = None
 		self._redirected = False
@@ -84,8 +87,7 @@ class StdTee:
 		self._stderr = None
 		self._teeout = None
 		self._teeerr = None
-		self._flushout = False
-		self._flusherr = False
+		self._unflushed = None  # The std stream ('out' or 'err') that has been written to since it was last flushed (only tracked if auto flushing)
 
 	def __del__(self):
 		self._restore_std()
@@ -101,7 +103,7 @@ class StdTee:
 		return self
 
 	def _open_file(self):
-		self._file = open(self.file_path, 'a' if self.append else 'w', buffering=1 if self.file_line_buffered else -1)
+		self._file = open(self.file_path, 'a' if self.append else 'w', buffering=1 if self.file_line_buffered else self.file_buffer_size)
 
 	def _close_file(self):
 		if self._file:
@@ -121,31 +123,29 @@ class StdTee:
 			sys.stdout = self._teeout
 			if self.auto_flush:
 				self._stdout.flush()
-		self._flushout = False
 		if self.tee_stderr:
 			self._stderr = sys.stderr
 			self._teeerr = self._Err(self, self._stderr)
 			sys.stderr = self._teeerr
 			if self.auto_flush:
 				self._stderr.flush()
-		self._flusherr = False
+		self._unflushed = None
 		self._redirected = True
 
 	def _restore_std(self):
 		if self._stdout is not None and self._teeout is not None and sys.stdout is self._teeout:
-			if self.auto_flush and self._flushout:
+			if self.auto_flush and self._unflushed == 'out':
 				self._stdout.flush()
 			sys.stdout = self._stdout
 		self._stdout = None
 		self._teeout = None
-		self._flushout = False
 		if self._stderr is not None and self._teeerr is not None and sys.stderr is self._teeerr:
-			if self.auto_flush and self._flusherr:
+			if self.auto_flush and self._unflushed == 'err':
 				self._stderr.flush()
 			sys.stderr = self._stderr
 		self._stderr = None
 		self._teeerr = None
-		self._flusherr = False
+		self._unflushed = None
 		self._redirected = False
 
 	def __enter__(self):
@@ -209,67 +209,63 @@ class StdTee:
 		def __getattr__(self, attr):
 			return getattr(self.stream, attr)
 
-	@property
-	def _stdout_safe(self):
-		return self._stdout or sys.stdout
-
-	@property
-	def _stderr_safe(self):
-		return self._stderr or sys.stderr
-
-	@property
-	def _file_open(self):
-		return self._file and not self._file.closed
-
+	# Note: The redirection targets and file are accessed as plain attributes (no properties) as this is called for every single write
+	# Note: If auto flushing, the other std stream is only flushed when the written stream changes (consecutive writes to the same stream just skip this)
 	def _writing_to_out(self):
-		if self.auto_flush:
-			if self._flusherr:
-				self._stderr_safe.flush()
-				self._flusherr = False
-			self._flushout = True
+		if self.auto_flush and self._unflushed != 'out':
+			if self._unflushed == 'err':
+				(self._stderr or sys.stderr).flush()
+			self._unflushed = 'out'
 
 	def _writing_to_err(self):
-		if self.auto_flush:
-			if self._flushout:
-				self._stdout_safe.flush()
-				self._flushout = False
-			self._flusherr = True
+		if self.auto_flush and self._unflushed != 'err':
+			if self._unflushed == 'out':
+				(self._stdout or sys.stdout).flush()
+			self._unflushed = 'err'
 
 	def _write_out(self, data):
 		self._writing_to_out()
-		self._stdout_safe.write(data)
-		if self._file_open:
-			self._file.write(data)
+		(self._stdout or sys.stdout).write(data)
+		file = self._file
+		if file and not file.closed:
+			file.write(data)
 
 	def _write_err(self, data):
 		self._writing_to_err()
-		self._stderr_safe.write(data)
-		if self._file_open:
-			self._file.write(data)
+		(self._stderr or sys.stderr).write(data)
+		file = self._file
+		if file and not file.closed:
+			file.write(data)
 
 	def _writelines_out(self, lines):
 		self._writing_to_out()
-		self._stdout_safe.writelines(lines)
-		if self._file_open:
-			self._file.writelines(lines)
+		(self._stdout or sys.stdout).writelines(lines)
+		file = self._file
+		if file and not file.closed:
+			file.writelines(lines)
 
 	def _writelines_err(self, lines):
 		self._writing_to_err()
-		self._stderr_safe.writelines(lines)
-		if self._file_open:
-			self._file.writelines(lines)
+		(self._stderr or sys.stderr).writelines(lines)
+		file = self._file
+		if file and not file.closed:
+			file.writelines(lines)
 
 	def _flush_out(self):
-		self._stdout_safe.flush()
-		if self._file_open:
-			self._file.flush()
-		self._flushout = False
+		(self._stdout or sys.stdout).flush()
+		file = self._file
+		if self.file_flush and file and not file.closed:
+			file.flush()
+		if self._unflushed == 'out':
+			self._unflushed = None
 
 	def _flush_err(self):
-		self._stderr_safe.flush()
-		if self._file_open:
-			self._file.flush()
-		self._flusherr = False
+		(self._stderr or sys.stderr).flush()
+		file = self._file
+		if self.file_flush and file and not file.closed:
+			file.flush()
+		if self._unflushed == 'err':
+			self._unflushed = None
 
 # Tee standard output/error to an in-memory string
 class StdTeeString(StdTee):
@@ -301,7 +297,7 @@ class StdTeeString(StdTee):
 	def _open_file(self):
 		if not self._file or not self.append:
 			super()._close_file()
-			self._file = io.StringIO()
+			self._file = self._StringFile()
 
 	def _close_file(self):
 		pass
@@ -320,4 +316,39 @@ class StdTeeString(StdTee):
 			return value
 		else:
 			return None
+
+	# List-backed string file (writes just append to a list of chunks, which only get joined when the value is actually queried)
+	class _StringFile:
+
+		def __init__(self):
+			self.closed = False
+			self._chunks = []
+
+		def write(self, data):
+			if not isinstance(data, str):
+				raise TypeError(f"string argument expected, got '{type(data).__name__}'")
+			self._chunks.append(data)
+			return len(data)
+
+		def writelines(self, lines):
+			lines = list(lines)
+			for line in lines:
+				if not isinstance(line, str):
+					raise TypeError(f"string argument expected, got '{type(line).__name__}'")
+			self._chunks.extend(lines)
+
+		def flush(self):
+			pass
+
+		def close(self):
+			self.closed = True
+			self._chunks = []
+
+		def getvalue(self):
+			chunks = self._chunks
+			if len(chunks) == 1:
+				return chunks[0]
+			value = ''.join(chunks)
+			self._chunks = [value]  # Note: Joined chunks are kept so that repeated queries without new writes do not join again
+			return value
 # EOF
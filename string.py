@@ -3,8 +3,13 @@
 # Imports
 import re
 import codecs
+import functools
 import unidecode
 
+# Constants
+UNIDECODE_CACHE_SIZE = 4096     # Maximum number of cached unidecode results
+UNIDECODE_CACHE_MAX_LEN = 256   # Maximum length of a string for its unidecode result to be cached
+
 # Basic conversion of string to ranged integer
 def ranged_int(string, imin=None, imax=None):
 	value = int(string)  # Note: This may also raise a TypeError if 'string' is not a string
@@ -41,16 +46,27 @@ def remove_spaces(string):
 def clean_spaces(string):
 	return ' '.join(string.split())
 
+# Transliterate a string to ASCII using unidecode with an LRU cache of the results (see unidecode_cached)
+@functools.lru_cache(maxsize=UNIDECODE_CACHE_SIZE)
+def _unidecode_lru(string):
+	return unidecode.unidecode(string)
+
+# Transliterate a string to ASCII using unidecode (results for short strings are cached as these tend to recur, e.g. names and tokens)
+def unidecode_cached(string):
+	if string.isascii():
+		return string  # Note: Unidecode leaves ASCII strings unchanged, but still processes every character in Python
+	return _unidecode_lru(string) if len(string) <= UNIDECODE_CACHE_MAX_LEN else unidecode.unidecode(string)
+
 # Convert a string to its standard representation for comparisons (e.g. cleaning whitespace, removing accents, making lowercase and removing non-letter characters)
 def clean_string(string):
-	string = unidecode.unidecode(string).lower()
+	string = unidecode_cached(string).lower()
 	string = re.sub(r'[^\w\s]', '', string)  # Remove all non-word/non-whitespace characters from the string
 	string = clean_spaces(string)
 	return string
 
 # Clean up a string somewhat (lite version of clean_string above)
 def clean_string_lite(string):
-	string = unidecode.unidecode(string)
+	string = unidecode_cached(string)
 	string = clean_spaces(string)
 	return string
 
@@ -68,7 +84,10 @@ def strtobool(value):
 # Resource: https://pubs.opengroup.org/onlinepubs/9699919799/basedefs/V1_chap03.html#tag_03_170
 def ensure_filename(string):
 	string = string.translate(str.maketrans('/', '_', '\0'))  # Convert '/' to '_' and remove null characters
-	string = string.encode('utf-8')[:255].decode('utf-8', errors='ignore')  # Limit to 255 bytes (this will often correspond to less than 255 actual characters due to multibyte unicode characters)
+	if string.isascii():
+		string = string[:255]  # Limit to 255 bytes (every ASCII character is a single byte)
+	else:
+		string = string.encode('utf-8')[:255].decode('utf-8', errors='ignore')  # Limit to 255 bytes (this will often correspond to less than 255 actual characters due to multibyte unicode characters)
 	if string == '.' or string == '..':
 		string = '...'
 	if not string:
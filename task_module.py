@@ -1,25 +1,138 @@
 # Generic module classes for executing tasks optionally in a child process
 
 # Imports
+import gc
+import os
 import abc
-import time
-import queue
+import pickle
+import struct
+import threading
 import contextlib
 import multiprocessing
+import multiprocessing.shared_memory
 from typing import Any
 
 # Constants
-MP = multiprocessing.get_context('forkserver')  # Note: Forkserver (or spawn) is required instead of fork if you want to use CUDA in the subprocesses
+MP = multiprocessing.get_context(os.environ.get('PPYUTIL_MP_METHOD', 'forkserver'))  # Note: Forkserver (or spawn) is required instead of fork if you want to use CUDA in the subprocesses, but fork (e.g. PPYUTIL_MP_METHOD=fork) starts subprocesses faster and lets them inherit already imported modules and data, provided no threads (e.g. of torch or tensorflow) are running in the main process
+CLEANUP_WAIT_TIMEOUT = 0.05  # Maximum time in seconds to wait for cleanup progress of other pipeline elements before retrying a cleanup
+QUEUE_SHM_THRESHOLD = 65536  # Minimum size in bytes of a pickle buffer (e.g. the data of a contiguous numpy array) for a queue sender to transfer it via shared memory instead of the pipe
+QUEUE_TRAILER_LEN = struct.Struct('<I')  # Format of the length of the shared memory trailer at the end of each queue message
+SHM_QUEUE_SLOT_NBYTES = 16384  # Default number of bytes per data slot of a shared memory queue sender
+SHM_QUEUE_NUM_SLOTS = 4  # Default number of data slots of a shared memory queue sender
+SHM_QUEUE_LEN = struct.Struct('<Q')  # Format of the message length at the start of each data slot of a shared memory queue sender
+SHM_QUEUE_OVERSIZED = 1 << 63  # Flag in the message length that indicates that the data slot contains the name of a separate shared memory block holding the message
 
 # Data signal classes
+# Note: The classes themselves are used as the signal values, and should be compared using 'is' (classes are pickled by
+#       reference, so the identity of the signal values is preserved across processes)
 class DataPending:
 	pass
 class DataAbort:
 	pass
 
+# Data batch class
+class DataBatch:
+	# A data batch can be returned by process() to output multiple data items at once. The batch is sent on to all
+	# receivers as a single object (e.g. a single IPC handoff for remote links), and each item is then individually passed
+	# on to process() by receiving tasks (see ModuleTask.process_batch) or to process_sink_data() by the pipeline for sinks.
+	# DataPending items are dropped from a batch, and a None item marks the end of the data (any further items are dropped).
+
+	def __init__(self, items):
+		# items = Iterable of data items to batch
+		self.items = []
+		for item in items:
+			if item is not DataPending:
+				self.items.append(item)
+				if item is None:
+					break
+
+	@property
+	def final(self):
+		# Return whether the batch ends the data (i.e. whether the batch ends with a None item)
+		return bool(self.items) and self.items[-1] is None
+
+# Check whether data marks the end of the data
+def is_final(data):
+	return data is None or (isinstance(data, DataBatch) and data.final)
+
+# Abort event class
+class AbortEvent:
+	# Event that is used to abort a pipeline, extended by a condition variable that is notified whenever an element of the
+	# pipeline makes cleanup progress (or the event is set). This allows cleanup loops to sleep until something happens
+	# instead of polling. Cleanup progress is tracked by a shared counter, so that progress that is made between a failed
+	# cleanup attempt and the subsequent wait is not missed. As the event is checked multiple times per step by every
+	# module task, the state of the event is additionally mirrored in a shared memory flag, which can be read without
+	# acquiring any locks (while a pipeline runs, the flag only ever changes from unset to set, so no synchronisation is
+	# required). The event is cleared at the start of every run of a pipeline, so that an aborted pipeline can be rerun. The
+	# event also provides a binary semaphore that remote senders to sinks release whenever they have sent sink data (see
+	# SinkSender), so that the main loop of the pipeline can sleep until sink data may be available instead of polling.
+
+	def __init__(self):
+		self.flag = MP.RawValue('B', 0)
+		self.event = MP.Event()
+		self.progress = MP.Condition()
+		self.progress_count = MP.RawValue('Q', 0)
+		self.sink_data = MP.BoundedSemaphore(1)
+		self.sink_data.acquire()
+
+	def is_set(self):
+		return self.flag.value != 0
+
+	def set(self):
+		self.flag.value = 1
+		self.event.set()
+		self.notify_sink_data()
+		self.notify_progress()
+
+	def clear(self):
+		# Note: This must only be called while no element of the pipeline is running (e.g. at the start of a run)
+		self.flag.value = 0
+		self.event.clear()
+		with self.progress:
+			self.progress_count.value = 0
+		self.sink_data.acquire(block=False)
+
+	def wait(self, timeout=None):
+		# timeout = Maximum time in seconds to wait for the event to be set
+		# Return whether the event is set
+		return self.event.wait(timeout)
+
+	def notify_progress(self):
+		with self.progress:
+			self.progress_count.value += 1
+			self.progress.notify_all()
+
+	def wait_progress(self, progress_count, timeout=CLEANUP_WAIT_TIMEOUT):
+		# progress_count = Value of self.progress_count.value before the last cleanup attempt
+		# timeout = Maximum time in seconds to wait for progress
+		# Return whether any progress has been made since the given progress count
+		with self.progress:
+			return self.progress.wait_for(lambda: self.progress_count.value != progress_count, timeout=timeout)
+
+	def notify_sink_data(self):
+		try:
+			self.sink_data.release()
+		except ValueError:
+			pass  # Note: The semaphore is already released, and a single pending notification is enough to wake up the main loop
+
+	def wait_sink_data(self, timeout):
+		# timeout = Maximum time in seconds to wait for sink data (or the event) to be notified
+		# Return whether a notification was received
+		return self.sink_data.acquire(timeout=timeout)
+
+	def cleanup(self, cleanup_func):
+		# cleanup_func = Function to call to perform cleanup (returns whether further cleanup is required)
+		while True:
+			progress_count = self.progress_count.value
+			if not cleanup_func():
+				break
+			self.wait_progress(progress_count)
+
 # Element class
 class Element(abc.ABC):
 
+	output_array_nbytes = None  # If not None, remote links from this element transfer numpy arrays of up to this many bytes using an ArraySender (see create_remote_sender())
+
 	def __init__(self, remote):
 		# remote = Whether any link to this element needs to be remote
 		self.remote = remote
@@ -32,6 +145,8 @@ class Element(abc.ABC):
 		# src = Element to link the output of
 		# dest = Element to link the input of
 		sender = src.create_sender(remote=src.remote or dest.remote)
+		if src.remote and isinstance(dest, Sink):
+			sender = SinkSender(sender)
 		src.output_senders.append(sender)
 		dest.input_receiver = sender.create_receiver()
 
@@ -41,8 +156,11 @@ class Element(abc.ABC):
 		return self.create_remote_sender() if remote else FieldSender()
 
 	def create_remote_sender(self):
-		# Return a new sender of the required type
-		return QueueSender()
+		# Return a new sender of the required type (override this to use a different type of remote sender, e.g. QueueSender)
+		if self.output_array_nbytes is not None:
+			from ppyutil.task_module_array import ArraySender  # Note: Imported here so that numpy is only required if array senders are actually used
+			return ArraySender(self.output_array_nbytes)
+		return SharedMemoryQueueSender()
 
 	def register_pipeline(self, pipeline):
 		self.pipeline = pipeline
@@ -68,10 +186,21 @@ class Sink(Element):
 	def __init__(self):
 		super().__init__(False)
 		self.done = True
+		self.check_new_data = False
 
 	def __enter__(self):
 		# Return the class instance
+		if self.input_receiver is not None:
+			self.input_receiver.init()
 		self.done = False
+		sink_type = type(self)
+		if sink_type.new_data is not Sink.new_data:
+			self.check_new_data = True
+		elif sink_type.get_data is not Sink.get_data or self.input_receiver is None:
+			self.check_new_data = False
+		else:
+			self.check_new_data = type(self.input_receiver).new_data is not Receiver.new_data
+		# Note: Sink data is only checked for with new_data() before a non-blocking get_data() if new_data() can be relied on, i.e. if it is overridden, or if get_data() is not overridden and the input receiver implements new_data() (otherwise a non-blocking get_data() is just attempted)
 		return self
 
 	def __exit__(self, exc_type, exc_val, exc_tb):
@@ -88,15 +217,41 @@ class Sink(Element):
 		# Return the received sink data and whether the next call to step() will have work to do
 		if self.done or self.pipeline.abort_event.is_set():
 			return None, False
+		elif not block and self.check_new_data and not self.new_data():
+			return None, True  # Note: Checking for new data first avoids raising and catching a BlockingIOError in every step that has no sink data
 		else:
-			# noinspection PyUnusedLocal
-			sink_data = None
-			with contextlib.suppress(BlockingIOError):
+			try:
 				sink_data = self.get_data(block=block)
-				if sink_data is None:
+			except BlockingIOError:
+				sink_data = None
+			else:
+				if is_final(sink_data):
 					self.done = True
 			return sink_data, not (self.done or self.pipeline.abort_event.is_set())
 
+	def drain(self, max_items=64, block=True):
+		# max_items = Maximum number of sink data objects to receive (a data batch counts as one object)
+		# block = Whether to block until the first sink data object is available (further objects are only received if they are already available)
+		# Return a list of the received sink data items (excluding DataPending and the final None, and with data batches flattened) and whether the next call to drain() will have work to do
+		sink_items = []
+		num_received = 0
+		while num_received < max_items and not (self.done or self.pipeline.abort_event.is_set()):
+			first_block = block and num_received == 0
+			if not first_block and self.check_new_data and not self.new_data():
+				break
+			try:
+				sink_data = self.get_data(block=first_block)
+			except BlockingIOError:
+				break
+			num_received += 1
+			if is_final(sink_data):
+				self.done = True
+			if isinstance(sink_data, DataBatch):
+				sink_items.extend(sink_item for sink_item in sink_data.items if sink_item is not None)
+			elif sink_data is not None and sink_data is not DataPending:
+				sink_items.append(sink_data)
+		return sink_items, not (self.done or self.pipeline.abort_event.is_set())
+
 	def is_ongoing(self):
 		return not self.done
 
@@ -104,12 +259,23 @@ class Sink(Element):
 		if self.done:
 			return False
 		else:
-			with contextlib.suppress(BlockingIOError):
+			if self.check_new_data and not self.new_data():
+				return True
+			try:
 				sink_data = self.get_data(block=False)
-				if sink_data is None:
+			except BlockingIOError:
+				pass
+			else:
+				self.pipeline.abort_event.notify_progress()
+				if is_final(sink_data):
 					self.done = True
 			return not self.done
 
+	def new_data(self):
+		# Return whether sink data is available (i.e. whether a non-blocking call to get_data() would succeed)
+		# Note: If get_data() is overridden to retrieve sink data from elsewhere, this should ideally be overridden accordingly (otherwise it is not used, see __enter__())
+		return self.input_receiver.new_data()
+
 	def get_data(self, block=True):
 		# block = Whether to block until data is available
 		# Return the sink data or raise BlockingIOError if block is False but no data is available
@@ -134,7 +300,14 @@ class ModuleTask(abc.ABC):
 	# If process() at any point returns DataPending, all child tasks skip their call to process() and essentially just wait
 	# for future data that is not DataPending. If process() at any point returns DataAbort, the pipeline is put into the
 	# aborted state. This is noticed by all other tasks in the pipeline during their next call to step(), and they
-	# subsequently all exit and clean up after themselves for a safe pipeline exit.
+	# subsequently all exit and clean up after themselves for a safe pipeline exit. If process() returns a DataBatch, all
+	# the contained items are sent on as a single object, and child tasks call process_batch() for the batch (which by
+	# default calls process() for each item in turn and returns the outputs as a DataBatch again). If input_batch_size is
+	# greater than one, each step additionally receives any further input data that is already available (up to a total
+	# of input_batch_size objects) and processes it all together as a single batch, in order to amortize the per-step
+	# overhead when the task falls behind its input.
+
+	input_batch_size = 1  # Maximum number of input data objects to receive per step (see receive_input())
 
 	def __init__(self, input_receiver, output_senders, abort_event):
 		# input_receiver = Receiver to retrieve input data from (may be None)
@@ -144,6 +317,7 @@ class ModuleTask(abc.ABC):
 		if self.input_receiver:
 			self.input_receiver.init()
 		self.output_senders = tuple(output_senders)
+		self.all_output_senders = self.output_senders
 		for output_sender in self.output_senders:
 			output_sender.init()
 		self.abort_event = abort_event
@@ -154,6 +328,8 @@ class ModuleTask(abc.ABC):
 		# Return the class instance
 		self.input_done = not self.input_receiver
 		self.output_done = not self.output_senders
+		if self.input_done and type(self).step is ModuleTask.step:
+			self.step = self.step_source  # Note: The topology of a task is fixed, so tasks without an input receiver are specialised once here to skip all input handling in each step (unless step() is overridden)
 		return self
 
 	def __exit__(self, exc_type, exc_val, exc_tb):
@@ -161,53 +337,100 @@ class ModuleTask(abc.ABC):
 		# Return whether to suppress the exception
 		if exc_type is not None or self.is_ongoing():
 			self.abort_event.set()
-			while self.cleanup():
-				time.sleep(0.003)
+			self.abort_event.cleanup(self.cleanup)
+		for output_sender in self.all_output_senders:
+			output_sender.close()
 		return False
 
 	def step(self):
 		# Return whether the next call to step() will have work to do
-		if (self.input_done and self.output_done) or self.abort_event.is_set():
+		abort_is_set = self.abort_event.is_set  # Note: Bound locally as it is called up to four times per step
+		if (self.input_done and self.output_done) or abort_is_set():
 			return False
 		else:
 			input_data = None
 			if not self.input_done:
-				input_data = self.input_receiver.receive(block=True)
-				if input_data is None:
+				input_data = self.receive_input()
+				if is_final(input_data):
 					self.input_done = True
-				if self.abort_event.is_set():
+				if abort_is_set():
 					return False
-			if input_data == DataPending:
+			if input_data is DataPending:
 				output_data = DataPending
 			else:
-				output_data = self.process(input_data)
-				if self.abort_event.is_set():
+				if isinstance(input_data, DataBatch):
+					output_data = self.process_batch(input_data.items)
+				else:
+					output_data = self.process(input_data)
+				if abort_is_set():
 					return False
-				elif output_data == DataAbort:
+				elif output_data is DataAbort:
 					self.abort_event.set()
 					return False
 			if not self.output_done:
 				for output_sender in self.output_senders:
 					output_sender.send(output_data, block=True)
-				if output_data is None:
+				if is_final(output_data):
 					self.output_done = True
-			return not ((self.input_done and self.output_done) or self.abort_event.is_set())
+			return not ((self.input_done and self.output_done) or abort_is_set())
+
+	def step_source(self):
+		# Return whether the next call to step() will have work to do
+		# Note: This is equivalent to step() for tasks that have no input receiver, i.e. where input_done is always True
+		abort_is_set = self.abort_event.is_set
+		if self.output_done or abort_is_set():
+			return False
+		output_data = self.process(None)
+		if abort_is_set():
+			return False
+		elif output_data is DataAbort:
+			self.abort_event.set()
+			return False
+		for output_sender in self.output_senders:
+			output_sender.send(output_data, block=True)
+		if is_final(output_data):
+			self.output_done = True
+		return not (self.output_done or abort_is_set())
+
+	def receive_input(self):
+		# Return the next input data, or if input batching is enabled, a batch of all available input data
+		if self.input_batch_size <= 1:
+			return self.input_receiver.receive(block=True)
+		input_list = self.input_receiver.receive_many(self.input_batch_size)
+		if len(input_list) == 1:
+			return input_list[0]
+		input_items = []
+		for input_data in input_list:
+			if isinstance(input_data, DataBatch):
+				input_items.extend(input_data.items)
+			else:
+				input_items.append(input_data)
+		input_batch = DataBatch(input_items)
+		return input_batch if input_batch.items else DataPending
 
 	def is_ongoing(self):
 		return not (self.input_done and self.output_done)
 
 	def cleanup(self):
+		progress = False
 		if not self.input_done:
-			with contextlib.suppress(BlockingIOError):
+			try:
 				input_data = self.input_receiver.receive(block=False)
-				if input_data is None:
+			except BlockingIOError:
+				pass
+			else:
+				progress = True
+				if is_final(input_data):
 					self.input_done = True
 		if not self.output_done:
-			output_sents = tuple(output_sender.send(None, block=False) for output_sender in self.output_senders)
-			if all(output_sents):
+			unsent_senders = [output_sender for output_sender in self.output_senders if not output_sender.send(None, block=False)]
+			if not unsent_senders:
 				self.output_done = True
-			elif any(output_sents):
-				self.output_senders = tuple(output_sender for output_sender, output_sent in zip(self.output_senders, output_sents) if output_sent)
+			if len(unsent_senders) < len(self.output_senders):
+				self.output_senders = tuple(unsent_senders)
+				progress = True
+		if progress:
+			self.abort_event.notify_progress()
 		return not (self.input_done and self.output_done)
 
 	@abc.abstractmethod
@@ -216,16 +439,41 @@ class ModuleTask(abc.ABC):
 		# Return the processed output data
 		pass
 
+	def process_batch(self, input_items) -> Any:
+		# input_items = List of input data items to process (DataPending never occurs, and None can only be the last item)
+		# Return the processed output data (this can be overridden to process all items at once, e.g. vectorized)
+		output_items = []
+		for input_data in input_items:
+			output_data = self.process(input_data)
+			if output_data is DataAbort:
+				return DataAbort
+			elif isinstance(output_data, DataBatch):
+				output_items.extend(output_data.items)
+			else:
+				output_items.append(output_data)
+			if output_items and output_items[-1] is None:
+				break
+		output_batch = DataBatch(output_items)
+		return output_batch if output_batch.items else DataPending
+
 # Module class
 class Module(Element):
 
+	# Remote modules normally run their task in a subprocess. If use_thread is set to True (e.g. by a subclass), a remote
+	# module instead runs its task in a separate thread of the main process, which still uses remote senders to link to
+	# other elements. This allows the task to run concurrently to the main loop of the pipeline without the cost of a
+	# subprocess, which is worthwhile if process() spends most of its time in code that releases the GIL (e.g. numpy,
+	# torch or I/O). The module task must then be safe to run in a thread alongside the rest of the main process.
+	use_thread = False
+
 	def __init__(self, remote, *task_args, **task_kwargs):
-		# remote = Whether this module should run its task in a subprocess
+		# remote = Whether this module should run its task in a subprocess (or thread, see use_thread)
 		# task_args = Extra arguments to supply to the module task
 		# task_kwargs = Extra keyword arguments to supply to the module task
 		super().__init__(remote)
 		self.task_args = task_args
 		self.task_kwargs = task_kwargs
+		self.cpu_affinity = None  # Set of CPUs to restrict the task of a remote module to (None = No restriction, only supported on platforms that have os.sched_setaffinity)
 		self.task = None
 		self.proc = None
 
@@ -242,7 +490,8 @@ class Module(Element):
 	def __enter__(self):
 		# Return the class instance
 		if self.remote:
-			self.proc = MP.Process(target=self.run, args=(self.input_receiver, self.output_senders, self.pipeline.abort_event, self.task_args, self.task_kwargs), daemon=True)
+			run_args = (self.input_receiver, self.output_senders, self.pipeline.abort_event, self.task_args, self.task_kwargs, self.cpu_affinity, self.pipeline.freeze_gc)
+			self.proc = (threading.Thread if self.use_thread else MP.Process)(target=self.run, name=type(self).__name__, args=run_args, daemon=True)
 			self.proc.start()
 		else:
 			self.task = self.create_task(self.input_receiver, self.output_senders, self.pipeline.abort_event, *self.task_args, **self.task_kwargs)
@@ -273,29 +522,54 @@ class Module(Element):
 		return self.task is not None and self.task.cleanup()
 
 	@classmethod
-	def run(cls, input_receiver, output_senders, abort_event, task_args, task_kwargs):
+	def run(cls, input_receiver, output_senders, abort_event, task_args, task_kwargs, cpu_affinity=None, freeze_gc=False):
 		# input_receiver = Receiver to retrieve input data from
 		# output_senders = List of senders to supply with output data
 		# abort_event = Event that can be used to abort the pipeline
 		# task_args = Extra arguments to supply to the module task
 		# task_kwargs = Extra keyword arguments to supply to the module task
+		# cpu_affinity = Set of CPUs to restrict the calling process/thread to (None = No restriction)
+		# freeze_gc = Whether to freeze all objects that exist after the setup of a task subprocess out of garbage collection (see Pipeline)
+		if cpu_affinity is not None:
+			os.sched_setaffinity(0, cpu_affinity)
 		with cls.create_task(input_receiver, output_senders, abort_event, *task_args, **task_kwargs) as task:
+			if freeze_gc and multiprocessing.parent_process() is not None:
+				gc.collect()
+				gc.freeze()  # Note: The subprocess only exists for the task, so its objects are never unfrozen
 			while task.step():
 				pass
 
 # Pipeline class
 class Pipeline:
 
-	def __init__(self, *modules, wait_time=3):
+	def __init__(self, *modules, wait_time=3, pin_cpus=False, freeze_gc=False):
 		# modules = Ordered list of modules and sinks to incorporate into the pipeline
-		# wait_time = If no local work needs to be done to run the pipeline and there is not just one sink that can comfortably block, wait this number of ms per cycle to avoid running an empty main loop at 100% CPU
+		# wait_time = If no local work needs to be done to run the pipeline and there is not just one sink that can comfortably block, wait up to this number of ms per cycle for remote modules to send sink data (or the pipeline to be aborted) to avoid running an empty main loop at 100% CPU
+		# pin_cpus = Whether to pin each remote module that has no explicit CPU affinity to a single CPU (assigned in pipeline order so that adjacent stages are on adjacent CPUs, and only supported on platforms that have os.sched_setaffinity)
+		# freeze_gc = Whether to move all objects that exist after the setup of the pipeline (and of each remote module subprocess) to the permanent generation of the garbage collector after a collection, so that they are not repeatedly scanned while the pipeline runs (in the main process they are only unfrozen again after the run if no objects were frozen beforehand, as gc.unfreeze() cannot tell them apart)
 		self.modules = tuple(module for module in modules if not isinstance(module, Sink))
 		self.sinks = tuple(module for module in modules if isinstance(module, Sink))
 		self.elements = self.modules + self.sinks
 		self.wait_time = wait_time / 1000
-		self.abort_event = MP.Event()
+		self.freeze_gc = freeze_gc
+		if pin_cpus:
+			cpus = sorted(os.sched_getaffinity(0))
+			for i, module in enumerate(module for module in self.modules if module.remote and module.cpu_affinity is None):
+				module.cpu_affinity = {cpus[i % len(cpus)]}
+		self.abort_event = AbortEvent()
 		for element in self.elements:
 			element.register_pipeline(self)
+		if len(self.sinks) != 1:
+			for module in self.modules:
+				for sender in module.output_senders:
+					if isinstance(sender, SinkSender):
+						sender.abort_event = self.abort_event  # Note: Remote senders to sinks only notify the main loop if it would otherwise have to poll for sink data, i.e. if it cannot just block on a single sink
+
+	@staticmethod
+	def preload(module_names):
+		# module_names = Names of the modules to import once in the forkserver process (e.g. heavy dependencies like numpy or torch), so that they are already imported in every remote module subprocess instead of being imported again by each one
+		# Note: This only has an effect if it is called before the first remote module of any pipeline is started (i.e. before the forkserver process is started), and if the forkserver start method is used (with fork, the subprocesses inherit all modules that are imported in the main process anyway)
+		MP.set_forkserver_preload(list(module_names))
 
 	def __enter__(self):
 		return self
@@ -305,19 +579,20 @@ class Pipeline:
 		# Return whether to suppress the exception
 		if exc_type is not None or any(element.is_ongoing() for element in self.elements):
 			self.abort_event.set()
-			while True:
-				cleanup_ongoing = False
-				for element in self.elements:
-					cleanup_ongoing |= element.cleanup()
-				if cleanup_ongoing:
-					time.sleep(0.003)
-				else:
-					break
+			self.abort_event.cleanup(self.cleanup)
 		return False
 
+	def cleanup(self):
+		# Return whether the next call to cleanup() will have work to do
+		cleanup_ongoing = False
+		for element in self.elements:
+			cleanup_ongoing |= element.cleanup()
+		return cleanup_ongoing
+
 	def run(self):
 		zero_sinks = not self.sinks
 		single_sink = (len(self.sinks) == 1)
+		self.abort_event.clear()  # Note: The pipeline may have been aborted in a previous run
 		with contextlib.ExitStack() as stack:
 			for i in range(len(self.sinks) - 1, -1, -1):
 				stack.enter_context(self.sinks[i])
@@ -325,21 +600,38 @@ class Pipeline:
 				stack.enter_context(self.modules[i])
 			# noinspection PyTypeChecker
 			stack.enter_context(self)
+			if self.freeze_gc:
+				gc.collect()  # Note: Garbage is collected first so that it is not kept alive by the freeze for the whole run
+				if gc.get_freeze_count() == 0:
+					stack.callback(gc.unfreeze)
+				gc.freeze()
+			# Note: The bound methods used in every iteration of the main loop are looked up once in advance
+			module_steps = tuple(module.step for module in self.modules if not module.remote)  # Note: Remote modules run their task in a subprocess or thread, so their step() never has any work to do in the main loop
+			sink_steps = tuple((sink, sink.step) for sink in self.sinks)
+			process_sink_data = self.process_sink_data
+			abort_is_set = self.abort_event.is_set
+			wait_sink_data = self.abort_event.wait_sink_data
+			wait_time = self.wait_time
 			while True:
 				local_work_ongoing = False
-				for module in self.modules:
-					local_work_ongoing |= module.step()
+				for module_step in module_steps:
+					local_work_ongoing |= module_step()
 				any_sink_ongoing = False
-				for sink in self.sinks:
-					sink_data, sink_ongoing = sink.step(block=not local_work_ongoing and single_sink)
-					if sink_ongoing and sink_data is not None and sink_data != DataPending:
-						self.process_sink_data(sink, sink_data)
+				for sink, sink_step in sink_steps:
+					sink_data, sink_ongoing = sink_step(block=not local_work_ongoing and single_sink)
+					if isinstance(sink_data, DataBatch):
+						if not abort_is_set():
+							for sink_item in sink_data.items:
+								if sink_item is not None:
+									process_sink_data(sink, sink_item)
+					elif sink_ongoing and sink_data is not None and sink_data is not DataPending:
+						process_sink_data(sink, sink_data)
 					any_sink_ongoing |= sink_ongoing
 				if not local_work_ongoing:
-					if not any_sink_ongoing and (not zero_sinks or self.abort_event.is_set()):  # If there are no sinks then we cannot know when the pipeline is actually finished, so we just keep going until we receive a kill signal (e.g. SIGINT) or an internal abort
+					if not any_sink_ongoing and (not zero_sinks or abort_is_set()):  # If there are no sinks then we cannot know when the pipeline is actually finished, so we just keep going until we receive a kill signal (e.g. SIGINT) or an internal abort
 						break
 					if not single_sink:
-						time.sleep(self.wait_time)
+						wait_sink_data(wait_time)
 
 	# noinspection PyMethodMayBeStatic
 	def process_sink_data(self, sink, sink_data):
@@ -351,19 +643,37 @@ class Pipeline:
 # Receiver class
 class Receiver(abc.ABC):
 
+	__slots__ = ()
+
 	def init(self):
 		# Perform initialisation actions that need to occur within the target process that the receiver will operate in
 		pass
 
+	def new_data(self):
+		# Return whether new data is available (i.e. whether a non-blocking receive would succeed)
+		# Note: Receivers that cannot cheaply check for new data can keep this default, in which case users of the receiver need to attempt a non-blocking receive instead (e.g. receive_many() then only receives one data object at a time)
+		return False
+
 	@abc.abstractmethod
 	def receive(self, block=True) -> Any:
 		# block = Whether to block until data is available
 		# Return the received data or raise BlockingIOError if block is False but no data is available
 		pass
 
+	def receive_many(self, max_items, block=True):
+		# max_items = Maximum number of data objects to receive
+		# block = Whether to block until the first data object is available (further objects are only received if they are already available)
+		# Return a list of the received data objects (stops after the final data) or raise BlockingIOError if block is False but no data is available
+		data_list = [self.receive(block=block)]
+		while len(data_list) < max_items and not is_final(data_list[-1]) and self.new_data():
+			data_list.append(self.receive(block=False))
+		return data_list
+
 # Sender class
 class Sender(abc.ABC):
 
+	__slots__ = ()
+
 	def init(self):
 		# Perform initialisation actions that need to occur within the target process that the sender will operate in
 		pass
@@ -380,12 +690,21 @@ class Sender(abc.ABC):
 		# Return whether the data was sent
 		pass
 
+	def close(self):
+		# Perform any actions that need to occur within the target process after the sender is no longer required
+		pass
+
 # Field receiver class
 class FieldReceiver(Receiver):
 
+	__slots__ = ('sender',)
+
 	def __init__(self, sender):
 		self.sender = sender
 
+	def new_data(self):
+		return self.sender.data_new
+
 	def receive(self, block=True):
 		if self.sender.data_new:
 			self.sender.data_new = False
@@ -398,6 +717,8 @@ class FieldReceiver(Receiver):
 # Field sender class
 class FieldSender(Sender):
 
+	__slots__ = ('data', 'data_new')
+
 	def __init__(self):
 		self.data = None
 		self.data_new = False
@@ -416,85 +737,295 @@ class FieldSender(Sender):
 			self.data_new = True
 			return True
 
+# Sink sender class
+class SinkSender(Sender):
+	# Wrapper for a remote sender that links a module to a sink, which notifies the abort event of the pipeline whenever
+	# data has been sent (if the abort event has been configured by the pipeline). This allows the main loop of a pipeline
+	# with multiple sinks to sleep until sink data may be available, instead of polling the sinks every wait_time.
+
+	__slots__ = ('sender', 'abort_event')
+
+	def __init__(self, sender):
+		# sender = Remote sender to wrap
+		self.sender = sender
+		self.abort_event = None
+
+	def init(self):
+		self.sender.init()
+
+	def create_receiver(self):
+		return self.sender.create_receiver()
+
+	def send(self, data, block=True):
+		sent = self.sender.send(data, block=block)
+		if sent and self.abort_event is not None:
+			self.abort_event.notify_sink_data()
+		return sent
+
+	def close(self):
+		self.sender.close()
+
+# Pack data into a message of raw bytes (see QueueSender)
+def pack_message(data):
+	# data = Data to pack
+	# Return the packed message bytes
+	if data is DataPending:
+		return PACKED_PENDING  # Note: The data signals are sent frequently and always pack to the same message, so the message is only created once
+	elif data is None:
+		return PACKED_NONE
+	shm_buffers = []
+	def buffer_callback(buffer):
+		raw = buffer.raw()
+		if raw.nbytes < QUEUE_SHM_THRESHOLD:
+			return True
+		shm = multiprocessing.shared_memory.SharedMemory(create=True, size=raw.nbytes)
+		shm.buf[:raw.nbytes] = raw
+		shm_buffers.append((shm.name, raw.nbytes))
+		shm.close()
+		return False
+	try:
+		header = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL, buffer_callback=buffer_callback)
+	except BaseException:
+		unlink_shm_buffers(shm_buffers)  # Note: Shared memory buffers that were already created before pickling failed are not referenced by any message
+		raise
+	trailer = pickle.dumps(shm_buffers, protocol=pickle.HIGHEST_PROTOCOL) if shm_buffers else b''
+	return header + trailer + QUEUE_TRAILER_LEN.pack(len(trailer))
+
+# Packed messages of the data signals
+PACKED_PENDING = pickle.dumps(DataPending, protocol=pickle.HIGHEST_PROTOCOL) + QUEUE_TRAILER_LEN.pack(0)
+PACKED_NONE = pickle.dumps(None, protocol=pickle.HIGHEST_PROTOCOL) + QUEUE_TRAILER_LEN.pack(0)
+
+# Unlink the shared memory buffers of a message that will not be unpacked (see pack_message())
+def unlink_shm_buffers(shm_buffers):
+	# shm_buffers = List of the names and sizes of the shared memory buffers
+	for shm_name, _ in shm_buffers:
+		shm = multiprocessing.shared_memory.SharedMemory(name=shm_name)
+		shm.close()
+		shm.unlink()
+
+# Discard a message of raw bytes that was packed but could not be sent (see QueueSender)
+def discard_message(message):
+	# message = Message bytes to discard
+	trailer_end = len(message) - QUEUE_TRAILER_LEN.size
+	header_end = trailer_end - QUEUE_TRAILER_LEN.unpack_from(message, trailer_end)[0]
+	if header_end < trailer_end:
+		unlink_shm_buffers(pickle.loads(message[header_end:trailer_end]))
+
+# Unpack data from a message of raw bytes (see QueueSender)
+def unpack_message(message):
+	# message = Memoryview of the message bytes to unpack (is not referenced by the returned data)
+	# Return the unpacked data
+	if message == PACKED_PENDING:
+		return DataPending
+	elif message == PACKED_NONE:
+		return None
+	trailer_end = len(message) - QUEUE_TRAILER_LEN.size
+	header_end = trailer_end - QUEUE_TRAILER_LEN.unpack_from(message, trailer_end)[0]
+	buffers = []
+	if header_end < trailer_end:
+		for shm_name, nbytes in pickle.loads(message[header_end:trailer_end]):
+			shm = multiprocessing.shared_memory.SharedMemory(name=shm_name)
+			buffers.append(bytearray(shm.buf[:nbytes]))  # Note: The buffer is copied out so that the shared memory can be released immediately without having to track the lifetime of the received data
+			shm.close()
+			shm.unlink()
+	return pickle.loads(message[:header_end], buffers=buffers)
+
 # Queue receiver class
 class QueueReceiver(Receiver):
 
-	def __init__(self, sender_queue):
-		self.queue = sender_queue
+	def __init__(self, reader, slot):
+		self.reader = reader
+		self.slot = slot
+
+	def new_data(self):
+		return self.reader.poll()
 
 	def receive(self, block=True):
-		try:
-			return self.queue.get(block=block)
-		except queue.Empty:
+		if not block and not self.reader.poll():
 			raise BlockingIOError
+		message = memoryview(self.reader.recv_bytes())
+		self.slot.release()
+		return unpack_message(message)
 
 # Queue sender class
 class QueueSender(Sender):
+	# Note: The queue is implemented as a one-way pipe with a semaphore that limits the number of unreceived objects in
+	#       the pipe to one (like a multiprocessing queue with maxsize 1). Unlike a multiprocessing queue, this requires no
+	#       feeder thread, and only needs a single mutex-free semaphore operation on top of the pipe write per send.
+	# Note: Data is pickled using the highest protocol (at least 5), and large out-of-band buffers (e.g. the data of
+	#       contiguous numpy arrays of at least QUEUE_SHM_THRESHOLD bytes) are transferred via shared memory instead of
+	#       being copied into the pickle and through the pipe. The receiver unlinks the shared memory once it has received
+	#       the data. Each message is sent as raw bytes, consisting of the data pickle followed by a trailer that lists the
+	#       shared memory buffers (pickled, and only if there are any) and ends with the length of the trailer.
 
 	def __init__(self):
-		self.queue = MP.Queue(maxsize=1)
+		self.reader, self.writer = MP.Pipe(duplex=False)
+		self.slot = MP.Semaphore(1)
 
 	def create_receiver(self):
-		return QueueReceiver(self.queue)
+		return QueueReceiver(self.reader, self.slot)
 
 	def send(self, data, block=True):
-		try:
-			self.queue.put(data, block=block)
-			return True
-		except queue.Full:
+		message = pack_message(data)  # Note: The data is packed before the slot is acquired so that a pickling error cannot leave the slot acquired
+		if not self.slot.acquire(block=block):
+			discard_message(message)
 			return False
+		self.writer.send_bytes(message)
+		return True
 
 # Shared memory receiver class
 class SharedMemoryReceiver(Receiver):
 
-	def __init__(self, lock, read_event, write_event):
-		self.lock = lock
-		self.read_event = read_event
-		self.write_event = write_event
+	def __init__(self, empty, full, num_slots=1):
+		# empty, full = Semaphores of the shared memory sender
+		# num_slots = Number of data slots of the shared memory sender
+		self.empty = empty
+		self.full = full
+		self.num_slots = num_slots
+		self.slot = 0
+		self.full_acquired = False
+
+	def init(self):
+		self.slot = 0  # Note: The receiver may persist across multiple runs of a pipeline (e.g. if it belongs to a sink), but each run starts a new sender at the first data slot (the ring buffer is always empty after a run, as all elements receive their input up to the final data)
+
+	def new_data(self):
+		# Note: Semaphore values cannot be queried portably, so the full slot is acquired (and remembered) if it is available
+		if not self.full_acquired:
+			self.full_acquired = self.full.acquire(block=False)
+		return self.full_acquired
 
 	def receive(self, block=True):
-		if block:
-			self.write_event.wait()
-		elif not self.write_event.is_set():
+		if not self.full_acquired and not self.full.acquire(block=block):
 			raise BlockingIOError
-		with self.lock:
-			data = self.read_data()
-			self.write_event.clear()
-			self.read_event.set()
-		return data
+		self.full_acquired = False
+		try:
+			return self.read_data()
+		finally:
+			self.empty.release()  # Note: The data slot is consumed even if reading the data raises (e.g. if unpickling fails), so that the ring buffer does not get stuck on it
+			self.slot = (self.slot + 1) % self.num_slots
 
 	@abc.abstractmethod
 	def read_data(self):
-		# Return the data stored in shared memory (needs to be able to receive None/DataPending)
+		# Return the data stored in the current data slot (self.slot) of the shared memory (needs to be able to receive None/DataPending)
 		pass
 
 # Shared memory sender class
 class SharedMemorySender(Sender):
+	# Note: The shared memory is used as a ring buffer of num_slots data slots, and access to it is coordinated by a pair
+	#       of semaphores that count the empty and full data slots. As there is only ever one sender and one receiver, no
+	#       additional lock or shared slot indices are required (the sender and receiver each step through the slots in
+	#       the same order), and each transfer just costs one semaphore acquire and release on each side. With more than
+	#       one slot, the sender can write further data while the receiver is still busy with earlier data. Subclasses
+	#       should allocate enough shared memory for num_slots data slots, and read/write the slot given by self.slot.
+	#       Subclasses that override init() must call the base implementation, which resets the data slot for each run.
+
+	def __init__(self, num_slots=1):
+		# num_slots = Number of data slots in the shared memory
+		self.num_slots = num_slots
+		self.slot = 0
+		self.empty = MP.Semaphore(num_slots)
+		self.full = MP.Semaphore(0)
 
-	def __init__(self):
-		self.lock = MP.RLock()
-		self.read_event = MP.Event()
-		self.write_event = MP.Event()
-		self.read_event.set()
+	def init(self):
+		self.slot = 0  # Note: Each run of a pipeline starts at the first data slot (see SharedMemoryReceiver.init())
 
 	@abc.abstractmethod
 	def create_receiver(self):
 		# Return a shared memory receiver that has access to all the required shared memory variables
-		return SharedMemoryReceiver(self.lock, self.read_event, self.write_event)
+		return SharedMemoryReceiver(self.empty, self.full, self.num_slots)
 
 	def send(self, data, block=True):
-		if block:
-			self.read_event.wait()
-		elif not self.read_event.is_set():
+		if not self.empty.acquire(block=block):
 			return False
-		with self.lock:
-			self.write_data(data)
-			self.read_event.clear()
-			self.write_event.set()
+		self.write_data(data)
+		self.full.release()
+		self.slot = (self.slot + 1) % self.num_slots
 		return True
 
 	@abc.abstractmethod
 	def write_data(self, data):
-		# data = Data to write into shared memory (needs to be able to send None/DataPending)
+		# data = Data to write into the current data slot (self.slot) of the shared memory (needs to be able to send None/DataPending)
 		pass
+
+# Shared memory queue receiver class
+class SharedMemoryQueueReceiver(SharedMemoryReceiver):
+
+	def __init__(self, buffer, slot_nbytes, *args):
+		# buffer = Shared memory buffer of the shared memory queue sender
+		# slot_nbytes = Number of bytes per data slot in the buffer
+		# args = Arguments to pass on to SharedMemoryReceiver
+		super().__init__(*args)
+		self.buffer = buffer
+		self.slot_nbytes = slot_nbytes
+
+	def read_data(self):
+		offset = self.slot * self.slot_nbytes
+		with memoryview(self.buffer).cast('B') as buffer_view:
+			nbytes = SHM_QUEUE_LEN.unpack_from(buffer_view, offset)[0]
+			offset += SHM_QUEUE_LEN.size
+			if not nbytes & SHM_QUEUE_OVERSIZED:
+				return unpack_message(buffer_view[offset:offset + nbytes])
+			nbytes &= ~SHM_QUEUE_OVERSIZED
+			name_nbytes = SHM_QUEUE_LEN.unpack_from(buffer_view, offset)[0]
+			offset += SHM_QUEUE_LEN.size
+			shm = multiprocessing.shared_memory.SharedMemory(name=bytes(buffer_view[offset:offset + name_nbytes]).decode())
+		message = shm.buf[:nbytes]
+		try:
+			return unpack_message(message)
+		finally:
+			message.release()
+			shm.close()
+			shm.unlink()
+
+# Shared memory queue sender class
+class SharedMemoryQueueSender(SharedMemorySender):
+	# Remote sender that transfers arbitrary data like QueueSender (i.e. packed into messages, see pack_message()), but
+	# instead of a pipe uses a ring buffer of num_slots fixed size data slots in shared memory. This avoids all system
+	# calls for transfers that do not need to wait, and allows the sender to write ahead of the receiver by up to
+	# num_slots objects. Messages that do not fit into a data slot are transferred via a separate shared memory block
+	# instead (whose name is stored in the data slot). Note that large pickle buffers (e.g. the data of numpy arrays)
+	# are never part of the messages anyway (see QUEUE_SHM_THRESHOLD), so only unusually large pickles are affected.
+
+	def __init__(self, slot_nbytes=SHM_QUEUE_SLOT_NBYTES, num_slots=SHM_QUEUE_NUM_SLOTS):
+		# slot_nbytes = Number of bytes per data slot (including the length of the message)
+		# num_slots = Number of data slots in shared memory
+		super().__init__(num_slots=num_slots)
+		self.slot_nbytes = slot_nbytes
+		self.buffer = MP.RawArray('B', num_slots * slot_nbytes)
+
+	def create_receiver(self):
+		return SharedMemoryQueueReceiver(self.buffer, self.slot_nbytes, self.empty, self.full, self.num_slots)
+
+	def send(self, data, block=True):
+		# Note: The data is packed (and if necessary stored in a separate shared memory block) before a data slot is acquired so that a pickling error cannot leave the slot acquired
+		message = pack_message(data)
+		nbytes = len(message)
+		if SHM_QUEUE_LEN.size + nbytes <= self.slot_nbytes:
+			shm = None
+			slot_data = (nbytes, message)
+		else:
+			try:
+				shm = multiprocessing.shared_memory.SharedMemory(create=True, size=nbytes)
+			except BaseException:
+				discard_message(message)
+				raise
+			shm.buf[:nbytes] = message
+			shm_name = shm.name.encode()
+			shm.close()
+			slot_data = (SHM_QUEUE_OVERSIZED | nbytes, SHM_QUEUE_LEN.pack(len(shm_name)) + shm_name)
+		if super().send(slot_data, block=block):
+			return True
+		discard_message(message)
+		if shm is not None:
+			shm.unlink()
+		return False
+
+	def write_data(self, data):
+		# data = Tuple of the message length (possibly flagged as oversized) and the bytes to store after it in the data slot
+		nbytes, slot_bytes = data
+		offset = self.slot * self.slot_nbytes
+		with memoryview(self.buffer).cast('B') as buffer_view:
+			SHM_QUEUE_LEN.pack_into(buffer_view, offset, nbytes)
+			offset += SHM_QUEUE_LEN.size
+			buffer_view[offset:offset + len(slot_bytes)] = slot_bytes
 # EOF
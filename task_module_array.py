@@ -0,0 +1,91 @@
+# Shared memory senders and receivers for transferring numpy arrays between task modules without pickling
+
+# Imports
+import math
+import numpy as np
+from ppyutil.task_module import MP, DataPending, SharedMemoryReceiver, SharedMemorySender
+
+# Constants
+MAX_NDIM = 8           # Maximum number of dimensions of arrays that can be transferred
+DTYPE_LEN = 16         # Maximum length in bytes of the string representation of the dtype of arrays that can be transferred
+SLOT_ALIGNMENT = 64    # Alignment in bytes of the data slots in shared memory
+HEADER_LEN = 2 + MAX_NDIM
+KIND_NONE = 0
+KIND_PENDING = 1
+KIND_ARRAY = 2
+
+# Array receiver class
+class ArrayReceiver(SharedMemoryReceiver):
+
+	def __init__(self, buffer, header, dtypes, slot_nbytes, *args):
+		# buffer, header, dtypes = Shared memory arrays of the array sender
+		# slot_nbytes = Number of bytes per data slot in the buffer
+		# args = Arguments to pass on to SharedMemoryReceiver
+		super().__init__(*args)
+		self.buffer = buffer
+		self.header = header
+		self.dtypes = dtypes
+		self.slot_nbytes = slot_nbytes
+
+	def read_data(self):
+		header = self.header[self.slot * HEADER_LEN:(self.slot + 1) * HEADER_LEN]
+		kind = header[0]
+		if kind == KIND_NONE:
+			return None
+		elif kind == KIND_PENDING:
+			return DataPending
+		shape = tuple(header[2:2 + header[1]])
+		dtype = np.dtype(self.dtypes[self.slot * DTYPE_LEN:(self.slot + 1) * DTYPE_LEN].rstrip(b'\0').decode())
+		return np.frombuffer(self.buffer, dtype=dtype, count=math.prod(shape), offset=self.slot * self.slot_nbytes).reshape(shape).copy()  # Note: The array is copied out as the data slot is reused as soon as the data has been read
+
+# Array sender class
+class ArraySender(SharedMemorySender):
+	# Shared memory sender that transfers numpy arrays (of any shape and non-object dtype) by copying their data directly
+	# into preallocated shared memory data slots, without pickling them or sending them through a pipe. Each data slot can
+	# hold an array of up to max_nbytes bytes, and with multiple slots the sender can write ahead of the receiver. To use
+	# it for the remote links of an element, set the output_array_nbytes attribute of the element (e.g. as a class attribute
+	# of a module subclass) to the maximum size in bytes of the arrays it outputs, or override its create_remote_sender()
+	# method to return a suitably configured ArraySender(). Apart from numpy arrays, only None and DataPending can be sent.
+
+	def __init__(self, max_nbytes, num_slots=2):
+		# max_nbytes = Maximum size in bytes of the arrays to send
+		# num_slots = Number of data slots in shared memory
+		super().__init__(num_slots=num_slots)
+		self.max_nbytes = max_nbytes
+		self.slot_nbytes = -(-max(max_nbytes, 1) // SLOT_ALIGNMENT) * SLOT_ALIGNMENT
+		self.buffer = MP.RawArray('B', num_slots * self.slot_nbytes)
+		self.header = MP.RawArray('q', num_slots * HEADER_LEN)
+		self.dtypes = MP.RawArray('c', num_slots * DTYPE_LEN)
+
+	def create_receiver(self):
+		return ArrayReceiver(self.buffer, self.header, self.dtypes, self.slot_nbytes, self.empty, self.full, self.num_slots)
+
+	def send(self, data, block=True):
+		if data is not None and data is not DataPending:
+			self.check_array(data)  # Note: The array is checked before a data slot is acquired so that an invalid array cannot leave the slot in an inconsistent state
+		return super().send(data, block=block)
+
+	def check_array(self, data):
+		# data = Data to check whether it can be sent
+		if not isinstance(data, np.ndarray):
+			raise TypeError(f"Array sender can only send numpy arrays, None and DataPending: {type(data)}")
+		if data.dtype.hasobject or data.dtype.names is not None:
+			raise TypeError(f"Array sender cannot send arrays of object or structured dtype: {data.dtype}")
+		if data.ndim > MAX_NDIM:
+			raise ValueError(f"Array sender cannot send arrays with more than {MAX_NDIM} dimensions: {data.ndim}")
+		if data.nbytes > self.max_nbytes:
+			raise ValueError(f"Array sender cannot send arrays larger than {self.max_nbytes} bytes: {data.nbytes}")
+		if len(data.dtype.str) > DTYPE_LEN:
+			raise ValueError(f"Array sender cannot send arrays with dtype string representations longer than {DTYPE_LEN} bytes: {data.dtype.str}")
+
+	def write_data(self, data):
+		start = self.slot * HEADER_LEN
+		if data is None:
+			self.header[start] = KIND_NONE
+		elif data is DataPending:
+			self.header[start] = KIND_PENDING
+		else:
+			self.header[start:start + 2 + data.ndim] = (KIND_ARRAY, data.ndim, *data.shape)
+			self.dtypes[self.slot * DTYPE_LEN:(self.slot + 1) * DTYPE_LEN] = data.dtype.str.encode().ljust(DTYPE_LEN, b'\0')
+			np.copyto(np.frombuffer(self.buffer, dtype=data.dtype, count=data.size, offset=self.slot * self.slot_nbytes).reshape(data.shape), data)
+# EOF
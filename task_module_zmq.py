@@ -0,0 +1,113 @@
+# ZeroMQ senders and receivers for task modules
+
+# Imports
+import os
+import uuid
+import tempfile
+import contextlib
+import zmq
+from ppyutil.task_module import Receiver, Sender, is_final
+
+# Constants
+RECONNECT_INTERVAL = 10     # Interval in ms at which a receiver retries to connect to a sender that has not bound its endpoint yet
+FINAL_ACK_TIMEOUT = 10000   # Maximum time in ms that a sender waits for the receiver to acknowledge the final data
+FINAL_ACK = b'ack'          # Message sent back by a receiver to acknowledge the final data
+
+# ZeroMQ receiver class
+class ZmqReceiver(Receiver):
+
+	def __init__(self, endpoint):
+		self.endpoint = endpoint
+		self.context = None
+		self.socket = None
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['context'] = None
+		state['socket'] = None
+		return state
+
+	def init(self):
+		if self.socket is None:
+			self.context = zmq.Context()
+			self.socket = self.context.socket(zmq.PAIR)
+			self.socket.setsockopt(zmq.RCVHWM, 1)
+			self.socket.setsockopt(zmq.RECONNECT_IVL, RECONNECT_INTERVAL)
+			self.socket.connect(self.endpoint)
+
+	def new_data(self):
+		if self.socket is None:
+			self.init()
+		return bool(self.socket.poll(0, zmq.POLLIN))
+
+	def receive(self, block=True):
+		if self.socket is None:
+			self.init()  # Note: The receiver is initialised lazily in case it is used without calling init() first
+		try:
+			data = self.socket.recv_pyobj(flags=0 if block else zmq.NOBLOCK)
+		except zmq.Again:
+			raise BlockingIOError from None
+		if is_final(data):
+			self.socket.send(FINAL_ACK)
+			self.socket.close(linger=FINAL_ACK_TIMEOUT)
+			self.context.term()
+			self.socket = None
+			self.context = None
+		return data
+
+# ZeroMQ sender class
+class ZmqSender(Sender):
+	# Remote sender that transfers data through a ZeroMQ PAIR socket over IPC instead of a pipe, which avoids any
+	# multiprocessing synchronization primitives on the data path. To use it for the remote links of an element, override
+	# its create_remote_sender() method to return a ZmqSender(). The socket high water marks are set to 1, which limits the
+	# number of data objects in flight similarly to the maxsize of 1 used by QueueSender (ZeroMQ only enforces high water
+	# marks approximately though, so a few data objects may be in flight at once). The sender binds the IPC endpoint, and
+	# the receiver connects to it (in whichever order they are initialised). ZeroMQ discards data that has not yet been read
+	# by the receiver if the sender disconnects, so when the sender is closed at the end of its module task it first waits for
+	# the receiver to acknowledge the final data, and then removes the IPC socket file.
+
+	def __init__(self):
+		self.path = os.path.join(tempfile.gettempdir(), f'ppyutil-{uuid.uuid4().hex}.sock')
+		self.endpoint = f"ipc://{self.path}"
+		self.context = None
+		self.socket = None
+		self.final_sent = False
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['context'] = None
+		state['socket'] = None
+		return state
+
+	def init(self):
+		if self.socket is None:
+			self.context = zmq.Context()
+			self.socket = self.context.socket(zmq.PAIR)
+			self.socket.setsockopt(zmq.SNDHWM, 1)
+			self.socket.bind(self.endpoint)
+
+	def create_receiver(self):
+		return ZmqReceiver(self.endpoint)
+
+	def send(self, data, block=True):
+		if self.socket is None:
+			self.init()
+		try:
+			self.socket.send_pyobj(data, flags=0 if block else zmq.NOBLOCK)
+		except zmq.Again:
+			return False
+		if is_final(data):
+			self.final_sent = True
+		return True
+
+	def close(self):
+		if self.socket is not None:
+			if self.final_sent and self.socket.poll(FINAL_ACK_TIMEOUT, zmq.POLLIN):
+				self.socket.recv()
+			self.socket.close(linger=0)
+			self.context.term()
+			self.socket = None
+			self.context = None
+		with contextlib.suppress(FileNotFoundError):
+			os.unlink(self.path)
+# EOF
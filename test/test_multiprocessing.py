@@ -1,6 +1,5 @@
 # Imports
 import sys
-import time
 import numpy as np
 import multiprocessing
 
@@ -12,6 +11,7 @@ def main():
 
 	image_size = (640, 480)
 	lock = MP.RLock()
+	events = tuple(MP.Event() for _ in range(4))  # Note: Each event marks the end of one stage of the experiment, alternating between the subprocess and the main process
 
 	image_array = MP.Array('B', image_size[0] * image_size[1] * 3, lock=False)
 	image = np.frombuffer(image_array, dtype='B').reshape((image_size[1], image_size[0], 3))
@@ -20,36 +20,40 @@ def main():
 	print(f"MAIN A: {image[0,0]}")
 
 	image_other = np.frombuffer(image_array, dtype='B').reshape((image_size[1], image_size[0], 3))
-	proc = MP.Process(target=subprocess_run, args=(image_size, image_array, lock, image_other), daemon=True)
+	proc = MP.Process(target=subprocess_run, args=(image_size, image_array, lock, image_other, events), daemon=True)
 	proc.start()
 
-	time.sleep(1)
+	events[0].wait()
 
 	with lock:
 		print(f"MAIN B: {image[0,0]}")
 		image.fill(44)
 		print(f"MAIN C: {image[0,0]}")
+	events[1].set()
 
-	time.sleep(5)
+	events[2].wait()
 
 	with lock:
 		print(f"MAIN D: {image[0,0]}")
+	events[3].set()
 
 	proc.join()
 
 	return True
 
 # Subprocess run
-def subprocess_run(image_size, image_array, lock, image_other):
+def subprocess_run(image_size, image_array, lock, image_other, events):
 	image = np.frombuffer(image_array, dtype='B').reshape((image_size[1], image_size[0], 3))
 	with lock:
 		print(f"SUB A: {image[0,0]} vs {image_other[0,0]}")
-	time.sleep(3)
+	events[0].set()
+	events[1].wait()
 	with lock:
 		print(f"SUB B: {image[0,0]} vs {image_other[0,0]}")
 		image.fill(11)
 		print(f"SUB C: {image[0,0]} vs {image_other[0,0]}")
-	time.sleep(5)
+	events[2].set()
+	events[3].wait()
 	with lock:
 		print(f"SUB D: {image[0,0]} vs {image_other[0,0]}")
 
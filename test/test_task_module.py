@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+# Test ppyutil.task_module
+
+# Imports
+import os
+import sys
+import gc
+import functools
+import numpy as np
+import pytest
+from ppyutil.task_module import MP, DataPending, DataAbort, DataBatch, Module, ModuleTask, Sink, Pipeline, Element, QueueSender, QUEUE_SHM_THRESHOLD, SHM_QUEUE_SLOT_NBYTES
+
+#
+# Test classes
+#
+
+# Data that can be pickled but raises an exception when it is unpickled
+class UnloadableData:
+
+	def __init__(self, count, payload=None):
+		self.count = count
+		self.payload = payload
+
+	def __reduce__(self):
+		return fail_unpickle, (self.count, self.payload)
+
+# Raise an exception on unpickling data (see UnloadableData)
+def fail_unpickle(count, payload):
+	raise ValueError(f"cannot unpickle {count}")
+
+# Source task that outputs the counts 1 to num (every fourth count as DataPending) and then None
+class CountTask(ModuleTask):
+
+	def __init__(self, input_receiver, output_senders, abort_event, num, abort_at=None, error_at=None, unpicklable_at=None, unloadable_at=None, payload=None, batch_size=None, start_event=None, end_event=None):
+		# num = Number of counts to output
+		# abort_at, error_at, unpicklable_at, unloadable_at = Count at which to output DataAbort, raise an exception, output unpicklable data, or output data that cannot be unpickled
+		# payload = Function that returns the payload to output together with each count (None = Output just the counts)
+		# batch_size = If not None, output the counts in data batches of this size (without any DataPending)
+		# start_event = If not None, event to wait for before outputting the first count
+		# end_event = If not None, event to set once all counts have been output (i.e. when the final None is output)
+		super().__init__(input_receiver, output_senders, abort_event)
+		self.num = num
+		self.abort_at = abort_at
+		self.error_at = error_at
+		self.unpicklable_at = unpicklable_at
+		self.unloadable_at = unloadable_at
+		self.payload = payload
+		self.batch_size = batch_size
+		self.start_event = start_event
+		self.end_event = end_event
+		self.count = 0
+
+	def process(self, input_data):
+		if self.count == 0 and self.start_event is not None:
+			self.start_event.wait()
+		if self.count >= self.num and self.end_event is not None:
+			self.end_event.set()
+		if self.batch_size is not None:
+			counts = range(self.count + 1, min(self.count + self.batch_size, self.num) + 1)
+			self.count += self.batch_size
+			return DataBatch(counts) if counts else None
+		self.count += 1
+		if self.count == self.abort_at:
+			return DataAbort
+		elif self.count == self.error_at:
+			raise ValueError(f"Source error at {self.count}")
+		elif self.count == self.unpicklable_at:
+			return lambda: self.count
+		elif self.count == self.unloadable_at:
+			return UnloadableData(self.count, None if self.payload is None else self.payload(self.count))
+		elif self.count > self.num:
+			return None
+		elif self.count % 4 == 0:
+			return DataPending
+		elif self.payload is not None:
+			return self.count, self.payload(self.count)
+		else:
+			return self.count
+
+# Source task that outputs just the payloads of the counts
+class ArrayCountTask(CountTask):
+
+	def process(self, input_data):
+		output_data = super().process(input_data)
+		return output_data[1] if isinstance(output_data, tuple) else output_data
+
+# Task that doubles the counts it receives
+class DoubleTask(ModuleTask):
+
+	def __init__(self, input_receiver, output_senders, abort_event, error_at=None):
+		# error_at = Number of received counts at which to raise an exception
+		super().__init__(input_receiver, output_senders, abort_event)
+		self.error_at = error_at
+		self.received = 0
+
+	def process(self, input_data):
+		if input_data is None:
+			return None
+		self.received += 1
+		if self.received == self.error_at:
+			raise ValueError(f"Double error at {self.received}")
+		if isinstance(input_data, tuple):
+			return 2 * input_data[0], input_data[1]
+		return 2 * input_data
+
+# Task that doubles the counts it receives, receiving them in batches where possible
+class BatchDoubleTask(DoubleTask):
+	input_batch_size = 4
+
+# Module that can be configured to use a different type of remote sender
+class SenderModule(Module):
+
+	sender_type = None  # Type of remote sender to create ('queue' = QueueSender, 'zmq' = ZmqSender, None = Default)
+
+	def create_remote_sender(self):
+		if self.sender_type == 'queue':
+			return QueueSender()
+		elif self.sender_type == 'zmq':
+			from ppyutil.task_module_zmq import ZmqSender  # Note: Imported here so that the tests only require pyzmq if ZmqSender links are tested
+			return ZmqSender()
+		return super().create_remote_sender()
+
+# Count module
+class Count(SenderModule):
+	@classmethod
+	def create_task(cls, input_receiver, output_senders, abort_event, *task_args, **task_kwargs):
+		return CountTask(input_receiver, output_senders, abort_event, *task_args, **task_kwargs)
+
+# Double module
+class Double(SenderModule):
+	@classmethod
+	def create_task(cls, input_receiver, output_senders, abort_event, *task_args, **task_kwargs):
+		return DoubleTask(input_receiver, output_senders, abort_event, *task_args, **task_kwargs)
+
+# Batch double module
+class BatchDouble(Module):
+	@classmethod
+	def create_task(cls, input_receiver, output_senders, abort_event, *task_args, **task_kwargs):
+		return BatchDoubleTask(input_receiver, output_senders, abort_event, *task_args, **task_kwargs)
+
+# Threaded count module
+class ThreadedCount(Count):
+	use_thread = True
+
+# Threaded double module
+class ThreadedDouble(Double):
+	use_thread = True
+
+# Array count module (outputs its payload arrays via an ArraySender)
+class ArrayCount(Module):
+
+	output_array_nbytes = 64
+
+	@classmethod
+	def create_task(cls, input_receiver, output_senders, abort_event, *task_args, **task_kwargs):
+		return ArrayCountTask(input_receiver, output_senders, abort_event, *task_args, **task_kwargs)
+
+# List sink
+class ListSink(Sink):
+
+	def __init__(self):
+		super().__init__()
+		self.items = []
+
+	def process(self, sink_data):
+		self.items.append(sink_data)
+
+#
+# Test helpers
+#
+
+# Array payload of a count
+def array_payload(shape, count):
+	return np.full(shape, count % 256, dtype=np.uint8)
+
+# List payload of a count
+def list_payload(length, count):
+	return list(range(count, count + length))
+
+# Create a module of the given class in the given mode ('local', 'remote' or 'thread') that uses the given type of remote sender (see SenderModule)
+def create_module(module_class, mode, sender_type, *task_args, **task_kwargs):
+	if mode == 'thread':
+		module_class = {Count: ThreadedCount, Double: ThreadedDouble}[module_class]
+	module = module_class(mode != 'local', *task_args, **task_kwargs)
+	module.sender_type = sender_type
+	return module
+
+# Create a count -> double -> sink(s) chain and return the pipeline and sinks
+def create_chain(src_mode, mid_mode, num_sinks=1, src_args=(), src_kwargs=None, mid_kwargs=None, sender_type=None, pipeline_kwargs=None):
+	src = create_module(Count, src_mode, sender_type, *src_args, **(src_kwargs or {}))
+	mid = create_module(Double, mid_mode, sender_type, **(mid_kwargs or {}))
+	sinks = tuple(ListSink() for _ in range(num_sinks))
+	Element.link(src, mid)
+	for sink in sinks:
+		Element.link(mid, sink)
+	return Pipeline(src, mid, *sinks, **(pipeline_kwargs or {})), sinks
+
+# Return the doubled counts expected from a chain with a count source of the given number of counts
+def expected_counts(num):
+	return [2 * count for count in range(1, num + 1) if count % 4 != 0]
+
+# Return the set of shared memory blocks that currently exist, excluding semaphores (or None if this is not supported on the platform)
+def shm_blocks():
+	return {name for name in os.listdir('/dev/shm') if not name.startswith('sem.')} if os.path.isdir('/dev/shm') else None
+
+# Run a pipeline once
+def run_pipeline(pipeline):
+	with pipeline:
+		pipeline.run()
+
+#
+# Test pipelines
+#
+
+SENDER_TYPES = (None, 'queue')
+
+@pytest.mark.parametrize('sender_type', SENDER_TYPES)
+def test_pipeline_chains(sender_type):
+	for src_mode in ('local', 'remote', 'thread'):
+		for mid_mode in ('local', 'remote', 'thread'):
+			for num_sinks in (1, 2):
+				pipeline, sinks = create_chain(src_mode, mid_mode, num_sinks=num_sinks, src_args=(30,), sender_type=sender_type)
+				run_pipeline(pipeline)
+				for sink in sinks:
+					assert sink.items == expected_counts(30), (src_mode, mid_mode, num_sinks)
+
+@pytest.mark.skipif(not hasattr(os, 'sched_setaffinity'), reason="CPU affinity is not supported on this platform")
+def test_pipeline_options():
+	freeze_count = gc.get_freeze_count()
+	for src_mode, mid_mode in (('remote', 'remote'), ('local', 'remote'), ('thread', 'remote'), ('remote', 'thread')):
+		pipeline, sinks = create_chain(src_mode, mid_mode, num_sinks=2, src_args=(30,), pipeline_kwargs=dict(pin_cpus=True, freeze_gc=True))
+		assert all(module.cpu_affinity is not None for module in pipeline.modules if module.remote)
+		run_pipeline(pipeline)
+		for sink in sinks:
+			assert sink.items == expected_counts(30), (src_mode, mid_mode)
+		if freeze_count == 0:
+			assert gc.get_freeze_count() == 0
+
+def test_pipeline_rerun():
+	# Note: Each run makes an odd number of transfers per link, so that the data slots of the links do not line up again by themselves
+	for num_sinks in (1, 2):
+		pipeline, sinks = create_chain('remote', 'remote', num_sinks=num_sinks, src_args=(2,))
+		for _ in range(3):
+			for sink in sinks:
+				sink.items.clear()
+			run_pipeline(pipeline)
+			for sink in sinks:
+				assert sink.items == expected_counts(2)
+	src = ArrayCount(True, 2, payload=functools.partial(array_payload, (2, 3)))
+	sink = ListSink()
+	Element.link(src, sink)
+	pipeline = Pipeline(src, sink)
+	for _ in range(3):
+		sink.items.clear()
+		run_pipeline(pipeline)
+		assert [item[0, 0] for item in sink.items] == [1, 2]
+
+@pytest.mark.parametrize('sender_type', SENDER_TYPES)
+def test_pipeline_abort(sender_type):
+	for src_mode in ('local', 'remote'):
+		for num_sinks in (1, 2):
+			pipeline, sinks = create_chain(src_mode, 'remote', num_sinks=num_sinks, src_args=(1000,), src_kwargs=dict(abort_at=50), sender_type=sender_type)
+			run_pipeline(pipeline)
+			assert pipeline.abort_event.is_set()
+			for sink in sinks:
+				assert sink.items == expected_counts(49)[:len(sink.items)]
+
+def test_pipeline_rerun_after_abort():
+	for src_mode in ('local', 'remote'):
+		pipeline, sinks = create_chain(src_mode, 'remote', num_sinks=2, src_args=(30,), src_kwargs=dict(abort_at=10))
+		run_pipeline(pipeline)
+		assert pipeline.abort_event.is_set()
+		del pipeline.modules[0].task_kwargs['abort_at']
+		for sink in sinks:
+			sink.items.clear()
+		run_pipeline(pipeline)
+		assert not pipeline.abort_event.is_set()
+		for sink in sinks:
+			assert sink.items == expected_counts(30), src_mode
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_pipeline_exception():
+	for src_mode, mid_mode in (('remote', 'remote'), ('thread', 'remote'), ('remote', 'thread')):
+		pipeline, sinks = create_chain(src_mode, mid_mode, src_args=(1000,), mid_kwargs=dict(error_at=20))
+		run_pipeline(pipeline)
+		assert pipeline.abort_event.is_set()
+		assert sinks[0].items == expected_counts(1000)[:len(sinks[0].items)] and len(sinks[0].items) <= 19
+	pipeline, sinks = create_chain('remote', 'local', src_args=(1000,), mid_kwargs=dict(error_at=20))
+	with pytest.raises(ValueError):
+		run_pipeline(pipeline)
+	assert pipeline.abort_event.is_set()
+	pipeline, sinks = create_chain('local', 'remote', src_args=(1000,), src_kwargs=dict(error_at=20))
+	with pytest.raises(ValueError):
+		run_pipeline(pipeline)
+	pipeline, sinks = create_chain('remote', 'remote', src_args=(1000,), src_kwargs=dict(unpicklable_at=10))
+	run_pipeline(pipeline)
+	assert pipeline.abort_event.is_set()
+	assert sinks[0].items == expected_counts(9)[:len(sinks[0].items)]
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+@pytest.mark.parametrize('sender_type', SENDER_TYPES)
+def test_unpickle_error(sender_type):
+	# Note: The data slot of data that fails to unpickle must still be consumed, so that cleanup receives the subsequent data instead of failing on the same data again
+	shm_before = shm_blocks()
+	for payload in (None, functools.partial(list_payload, SHM_QUEUE_SLOT_NBYTES)):
+		pipeline, sinks = create_chain('remote', 'local', src_args=(1000,), src_kwargs=dict(unloadable_at=5, payload=payload), sender_type=sender_type)
+		with pytest.raises(ValueError, match="cannot unpickle 5") as exc_info:
+			run_pipeline(pipeline)
+		assert exc_info.value.__context__ is None
+		assert pipeline.abort_event.is_set()
+		for mid_mode in ('remote', 'thread'):
+			pipeline, sinks = create_chain('remote', mid_mode, src_args=(1000,), src_kwargs=dict(unloadable_at=5, payload=payload), sender_type=sender_type)
+			run_pipeline(pipeline)
+			assert pipeline.abort_event.is_set()
+			assert len(sinks[0].items) <= 3
+	assert shm_blocks() == shm_before
+
+def test_zmq_sender():
+	pytest.importorskip('zmq')
+	for src_mode, mid_mode in (('remote', 'remote'), ('local', 'remote'), ('remote', 'local'), ('thread', 'remote')):
+		for num_sinks in (1, 2):
+			pipeline, sinks = create_chain(src_mode, mid_mode, num_sinks=num_sinks, src_args=(30,), sender_type='zmq')
+			run_pipeline(pipeline)
+			for sink in sinks:
+				assert sink.items == expected_counts(30), (src_mode, mid_mode, num_sinks)
+	pipeline, sinks = create_chain('remote', 'remote', num_sinks=2, src_args=(2,), sender_type='zmq')
+	for _ in range(3):
+		for sink in sinks:
+			sink.items.clear()
+		run_pipeline(pipeline)
+		for sink in sinks:
+			assert sink.items == expected_counts(2)
+	for src_mode in ('local', 'remote'):
+		pipeline, sinks = create_chain(src_mode, 'remote', num_sinks=2, src_args=(1000,), src_kwargs=dict(abort_at=50), sender_type='zmq')
+		socket_paths = [getattr(sender, 'sender', sender).path for module in pipeline.modules for sender in module.output_senders]
+		run_pipeline(pipeline)
+		assert pipeline.abort_event.is_set()
+		for sink in sinks:
+			assert sink.items == expected_counts(49)[:len(sink.items)]
+		assert not any(os.path.exists(socket_path) for socket_path in socket_paths)
+
+#
+# Test data transfer
+#
+
+@pytest.mark.parametrize('sender_type', SENDER_TYPES)
+def test_large_payload(sender_type):
+	shm_before = shm_blocks()
+	payload_nbytes = 2 * QUEUE_SHM_THRESHOLD
+	pipeline, sinks = create_chain('remote', 'remote', num_sinks=2, src_args=(10,), src_kwargs=dict(payload=functools.partial(array_payload, payload_nbytes)), sender_type=sender_type)
+	run_pipeline(pipeline)
+	for sink in sinks:
+		assert [item[0] for item in sink.items] == expected_counts(10)
+		for item in sink.items:
+			assert item[1].nbytes == payload_nbytes and np.all(item[1] == (item[0] // 2) % 256)
+	assert shm_blocks() == shm_before
+
+@pytest.mark.parametrize('sender_type', SENDER_TYPES)
+def test_oversized_message(sender_type):
+	shm_before = shm_blocks()
+	payload_len = SHM_QUEUE_SLOT_NBYTES
+	pipeline, sinks = create_chain('remote', 'remote', src_args=(10,), src_kwargs=dict(payload=functools.partial(list_payload, payload_len)), sender_type=sender_type)
+	run_pipeline(pipeline)
+	assert [item[0] for item in sinks[0].items] == expected_counts(10)
+	for item in sinks[0].items:
+		assert item[1] == list(range(item[0] // 2, item[0] // 2 + payload_len))
+	assert shm_blocks() == shm_before
+
+def test_data_batch():
+	for src_mode, mid_mode in (('remote', 'remote'), ('local', 'local'), ('remote', 'local')):
+		src = create_module(Count, src_mode, None, 50, batch_size=3)
+		mid = BatchDouble(mid_mode != 'local')
+		sink = ListSink()
+		Element.link(src, mid)
+		Element.link(mid, sink)
+		pipeline = Pipeline(src, mid, sink)
+		run_pipeline(pipeline)
+		assert sink.items == [2 * count for count in range(1, 51)], (src_mode, mid_mode)
+
+def test_sink_drain():
+	# Note: The source outputs all counts in 4 data batches, which fit exactly into the data slots of the default remote sender, so all batches are available once the source outputs the final None
+	start_event = MP.Event()
+	end_event = MP.Event()
+	src = create_module(Count, 'remote', None, 12, batch_size=3, start_event=start_event, end_event=end_event)
+	sink = ListSink()
+	Element.link(src, sink)
+	pipeline = Pipeline(src, sink)
+	with sink, src, pipeline:
+		assert sink.drain(block=False) == ([], True)
+		start_event.set()
+		assert end_event.wait(timeout=10)
+		assert sink.drain(max_items=2, block=False) == ([1, 2, 3, 4, 5, 6], True)
+		assert sink.drain(max_items=1) == ([7, 8, 9], True)
+		sink_items = []
+		while True:
+			drained_items, ongoing = sink.drain()
+			sink_items.extend(drained_items)
+			if not ongoing:
+				break
+		assert sink_items == [10, 11, 12]
+		assert sink.drain() == ([], False)
+
+#
+# Main function
+#
+
+def main():
+	print("BEGIN")
+	for sender_type in SENDER_TYPES:
+		test_pipeline_chains(sender_type)
+	test_pipeline_options()
+	test_pipeline_rerun()
+	for sender_type in SENDER_TYPES:
+		test_pipeline_abort(sender_type)
+	test_pipeline_rerun_after_abort()
+	test_pipeline_exception()
+	for sender_type in SENDER_TYPES:
+		test_unpickle_error(sender_type)
+	for sender_type in SENDER_TYPES:
+		test_large_payload(sender_type)
+		test_oversized_message(sender_type)
+	test_zmq_sender()
+	test_data_batch()
+	test_sink_drain()
+	print("END")
+
+if __name__ == "__main__":
+	sys.exit(main())
+# EOF